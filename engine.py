@@ -1,4 +1,8 @@
-from typing import Set, Iterable, Any
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Set, Iterable, Any, Deque, Iterator
 from time import time
 from tcod.context import Context
 from tcod.console import Console
@@ -9,15 +13,19 @@ from game_map import GameMap
 from actions import EscapeAction, MovementAction
 from entity import Entity
 from input_handlers import EventHandler
+from snapshot import Snapshot
 
 
 class Engine:
 
-    def __init__(self, event_handler: EventHandler, game_map: GameMap, player: Entity):
+    def __init__(self, event_handler: EventHandler, game_map: GameMap, player: Entity, history_limit: int = 1000):
         self.event_handler = event_handler
         self.player = player
         self.game_map = game_map
+        self.history: Deque[Snapshot] = deque(maxlen=history_limit)  # One undo record per turn, oldest first.
+        self.turn = 0
         self.update_fov()
+        self.game_map.take_snapshot()  # The generated world is the starting point, not something to undo.
 
     def handle_events(self, events: Iterable[Any]) -> None:
         for event in events:
@@ -27,15 +35,71 @@ class Engine:
                 continue
 
             action.perform(self, self.player)
+            z_before_falling = self.player.z
+            self.game_map.apply_gravity()
+            if self.player.z != z_before_falling:
+                self.game_map.view_depth = self.player.z  # Follow the player down when they fall.
             self.update_fov()  # Update the FOV before the players next action.
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """Record the changes made this turn, so they can be rolled back later."""
+        self.history.append(self.game_map.take_snapshot())
+        self.turn += 1
+
+    def rollback(self, turns: int = 1) -> None:
+        """
+        Undo the last few turns, along with anything changed since the last snapshot.
+
+        Turns older than the history limit can't be undone, so at most that many are rolled back.
+        Negative counts roll back only the changes since the last snapshot.
+        """
+        turns = max(0, min(turns, len(self.history)))
+        self.game_map.restore(self.game_map.take_snapshot())
+        for _ in range(turns):
+            self.game_map.restore(self.history.pop())
+        self.turn -= turns
+
+        self.game_map.view_depth = self.player.z
+        self.update_fov()
+        self.game_map.take_snapshot()  # Nothing new was explored; recomputing the FOV isn't a turn.
+
+    @contextmanager
+    def branch(self) -> Iterator[Engine]:
+        """
+        Let look-ahead AI or replays act on this engine, and roll the world back when the block exits.
+
+        with engine.branch():
+            action.perform(engine, entity)
+            engine.snapshot()
+
+        The branch gets its own unbounded history, so its turns can't push real ones out of history,
+        and neither history nor turn are changed once it exits.
+        """
+        # Set aside what changed before the branch, so the branch can be undone back to this point.
+        mark = self.game_map.take_snapshot()
+        history, turn, view_depth = self.history, self.turn, self.game_map.view_depth
+        self.history = deque()
+        try:
+            yield self
+        finally:
+            self.game_map.restore(self.game_map.take_snapshot())
+            while self.history:
+                self.game_map.restore(self.history.pop())
+            # Changes from before the branch are still pending, and belong to the current turn.
+            self.game_map.pending = mark
+            self.history, self.turn = history, turn
+            self.game_map.view_depth = view_depth
+            self.compute_3d_fov()
 
-    def update_fov(self) -> None:
+    def update_fov(self, radius: int = 8) -> None:
         """Recompute the visible area based on the players point of view."""
         # Right now we only compute the fov for the level the player is on.
         # We want to also do so spherically for each level the player isn't on.
-        self.compute_3d_fov()
+        self.compute_3d_fov(radius)
         # If a tile is "visible" it should be added to "explored".
-        self.game_map.explored |= self.game_map.visible
+        # Only the levels within the radius of the player can be visible.
+        self.game_map.update_explored(max(self.player.z - radius + 1, 0), self.player.z + radius)
 
     def compute_3d_fov(self, radius=8) -> None:
         currenttime = time()
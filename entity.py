@@ -1,8 +1,7 @@
 from __future__ import annotations
 
 import copy
-from typing import Tuple
-from typing import Tuple, TypeVar, TYPE_CHECKING
+from typing import Optional, Tuple, TypeVar, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from game_map import GameMap
@@ -13,6 +12,10 @@ T = TypeVar("T", bound="Entity")
 class Entity:
     """
     A generic object to represent players, enemies, items, etc.
+
+    So that changes can be rolled back, an entity on a map must record its fields before they change.
+    move does this itself; anything that sets fields directly (e.g. entity.x = ...) must call
+    gamemap.save_entity(entity) first. Entities are added and removed with GameMap.add_entity and remove_entity.
     """
 
     def __init__(self,
@@ -23,6 +26,7 @@ class Entity:
                  color: Tuple[int, int, int] = (255, 255, 255),
                  name: str = "<Unnamed>",
                  blocks_movement: bool = False,
+                 flying: bool = False,
                  ):
         self.x = x
         self.y = y
@@ -31,6 +35,8 @@ class Entity:
         self.color = color
         self.name = name
         self.blocks_movement = blocks_movement
+        self.flying = flying  # Flying entities ignore gravity.
+        self.gamemap: Optional[GameMap] = None  # The map this entity has been placed on.
 
     def spawn(self: T, gamemap: GameMap, x: int, y: int, z: int) -> T:
         """Spawn a copy of this instance at the given location."""
@@ -38,11 +44,13 @@ class Entity:
         clone.x = x
         clone.y = y
         clone.z = z
-        gamemap.entities.add(clone)
+        gamemap.add_entity(clone)
         return clone
 
     def move(self, dx: int, dy: int, dz: int) -> None:
         # Move the entity by a given amount
+        if self.gamemap is not None:
+            self.gamemap.save_entity(self)  # So the move can be rolled back.
         self.x += dx
         self.y += dy
         self.z += dz
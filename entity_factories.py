@@ -5,6 +5,6 @@ player = Entity(char="@", color=(255, 255, 255), name="Player", blocks_movement=
 orc = Entity(char="o", color=(63, 127, 63), name="Orc", blocks_movement=True)
 troll = Entity(char="T", color=(0, 127, 0), name="Troll", blocks_movement=True)
 slime = Entity(char="s", color=(30, 30, 230), name="Slime", blocks_movement=True)
-bat = Entity(char="b", color=(0, 0, 20), name="Bat", blocks_movement=True)
-imp = Entity(char="i", color=(60, 10, 60), name="Imp", blocks_movement=True)
+bat = Entity(char="b", color=(0, 0, 20), name="Bat", blocks_movement=True, flying=True)
+imp = Entity(char="i", color=(60, 10, 60), name="Imp", blocks_movement=True, flying=True)
 goblin = Entity(char="g", color=(93, 187, 93), name="Goblin", blocks_movement=True)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Iterable, TYPE_CHECKING, Optional
+from typing import Any, Iterable, TYPE_CHECKING, Optional, Tuple
 
 if TYPE_CHECKING:
     from entity import Entity
@@ -9,18 +9,30 @@ import numpy as np  # type: ignore
 from tcod.console import Console
 
 import tile_types
+from snapshot import Snapshot
 
+# How much each level below the view depth darkens what is seen through air, and the darkest it can get.
+DEPTH_SHADE = 0.12
+MIN_SHADE = 0.3
 
 
 class GameMap:
     def __init__(self, width: int, height: int, depth: int, entities: Iterable[Entity] = (), start_depth: int = 0):
         self.width, self.height, self.depth = width, height, depth
-        self.tiles = np.full((depth, width, height), fill_value=tile_types.wall, order="F")
+        self._tiles = np.full((depth, width, height), fill_value=tile_types.wall, order="F")
+        # A read only view of the tiles. Write them with set_tiles, so every change can be rolled back.
+        self.tiles = self._tiles.view()
+        self.tiles.flags.writeable = False
         self.view_depth = start_depth
+        self.see_through = False  # If True, levels below view_depth are drawn through air.
         self.rooms = []
         self.entities = set(entities)
+        for entity in self.entities:
+            entity.gamemap = self
         self.visible = np.full((depth,width, height), fill_value=False, order="F")  # Tiles the player can currently see
         self.explored = np.full((depth, width, height), fill_value=False, order="F")  # Tiles the player has seen before
+        # Changes made since the last snapshot was taken. None until the first one is, so generation isn't recorded.
+        self.pending: Optional[Snapshot] = None
 
     def get_blocking_entity_at_location(self, location_x: int, location_y: int, location_z: int) -> Optional[Entity]:
         for entity in self.entities:
@@ -29,7 +41,128 @@ class GameMap:
 
         return None
 
+    def apply_gravity(self) -> None:
+        """Drop every non-flying entity that is standing in air.
+
+        Positions of all entities are gathered into arrays so the air columns below them can be
+        checked in one vectorized lookup, instead of stepping each entity down a level at a time.
+        An entity falls until it reaches a grounded tile, the tile below it can't be walked into,
+        or the tile below it holds a blocking entity.
+        """
+        fallers = [entity for entity in self.entities if not entity.flying]
+        if not fallers:
+            return
+        zs = np.array([entity.z for entity in fallers])
+        xs = np.array([entity.x for entity in fallers])
+        ys = np.array([entity.y for entity in fallers])
+
+        # Only entities whose own tile isn't grounded can fall.
+        airborne = ~self.tiles["grounded"][zs, xs, ys]
+        if not airborne.any():
+            return
+        fallers = [entity for entity, falls in zip(fallers, airborne.tolist()) if falls]
+        zs, xs, ys = zs[airborne], xs[airborne], ys[airborne]
+
+        # Give every (x, y) column that has something falling down it a number.
+        columns = xs * self.height + ys
+        unique_columns, column_of = np.unique(columns, return_inverse=True)
+        # Levels of those columns taken by blocking entities that aren't falling.
+        occupied = np.zeros((self.depth, len(unique_columns)), dtype=bool)
+        falling = set(fallers)
+        blockers = [entity for entity in self.entities if entity.blocks_movement and entity not in falling]
+        if blockers:
+            blocker_zs = np.array([entity.z for entity in blockers])
+            blocker_columns = np.array([entity.x * self.height + entity.y for entity in blockers])
+            found = np.searchsorted(unique_columns, blocker_columns).clip(max=len(unique_columns) - 1)
+            in_column = unique_columns[found] == blocker_columns
+            occupied[blocker_zs[in_column], found[in_column]] = True
+        occupied = occupied[:, column_of]
+
+        # Columns of the map under each falling entity, shaped (depth, number of fallers).
+        grounded = self.tiles["grounded"][:, xs, ys]
+        walkable = self.tiles["walkable"][:, xs, ys]
+        # A level stops a fall if it is grounded, or if the level below it can't be entered.
+        stops = grounded
+        stops[:-1] |= ~walkable[1:] | occupied[1:]
+        stops[-1] = True
+        # Ignore everything above each entity, then take the first stop along z.
+        stops &= np.arange(self.depth)[:, np.newaxis] >= zs
+        landing = stops.argmax(axis=0)
+
+        # Blocking entities falling down the same column land on top of each other, lowest first.
+        # Sorted by column and then from the bottom up, each one lands at most one level above the one below it:
+        # landing[i] = min(landing[i], landing[i - 1] - 1). Adding the position in the column turns this into a
+        # running minimum, and offsetting each column by more than any landing keeps the columns apart.
+        chain = np.flatnonzero([entity.blocks_movement for entity in fallers])
+        if len(chain) > 1:
+            order = chain[np.lexsort((-zs[chain], columns[chain]))]
+            sorted_columns = columns[order]
+            column_starts = np.r_[True, sorted_columns[1:] != sorted_columns[:-1]]
+            column_number = np.cumsum(column_starts) - 1
+            position = np.arange(len(order)) - np.flatnonzero(column_starts)[column_number]
+            offset = (column_number[-1] - column_number) * (self.depth + len(order)) + position
+            landing[order] = np.minimum.accumulate(landing[order] + offset) - offset
+
+        for entity, z in zip(fallers, landing.tolist()):
+            if entity.z != z:
+                self.save_entity(entity)
+                entity.z = z
 
+    def set_tiles(self, index: Any, tile: np.ndarray) -> None:
+        """Write tiles at the given (z, x, y) index, saving the blocks it overwrites so it can be rolled back."""
+        if self.pending is not None:
+            self.pending.save_tile_blocks(self._tiles, index)
+        self._tiles[index] = tile
+
+    def add_entity(self, entity: Entity) -> None:
+        """Place an entity on this map, recording it so it is removed again on rollback."""
+        entity.gamemap = self
+        self.entities.add(entity)
+        if self.pending is not None:
+            self.pending.added.add(entity)
+
+    def remove_entity(self, entity: Entity) -> None:
+        """Take an entity off this map, saving it first so it is put back on rollback."""
+        self.save_entity(entity)
+        self.entities.discard(entity)
+        entity.gamemap = None
+
+    def save_entity(self, entity: Entity) -> None:
+        """Record an entity's fields before it is changed, so the change can be rolled back."""
+        if self.pending is not None:
+            self.pending.save_entity(entity)
+
+    def update_explored(self, z_start: int, z_stop: int) -> None:
+        """Add the visible tiles between the given levels to explored, recording which ones are new."""
+        newly_explored = self.visible[z_start:z_stop] & ~self.explored[z_start:z_stop]
+        z, x, y = np.nonzero(newly_explored)
+        if len(z):
+            if self.pending is not None:
+                self.pending.explored.append((z + z_start, x, y))
+            self.explored[z_start:z_stop] |= newly_explored
+
+    def take_snapshot(self) -> Snapshot:
+        """
+        Return the changes made since the last snapshot, and start recording a new one.
+
+        Entities save their own fields as they change (see save_entity),
+        so this doesn't need to look at the ones that didn't.
+        """
+        snapshot = self.pending if self.pending is not None else Snapshot()
+        self.pending = Snapshot()
+        return snapshot
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """
+        Undo the changes recorded in a snapshot.
+
+        Snapshots must be restored newest first, with nothing pending, for the map to come back in one piece.
+        """
+        snapshot.restore(self._tiles, self.explored)
+        self.entities -= snapshot.added
+        for entity, fields in snapshot.entity_fields.items():
+            vars(entity).update(fields)
+            self.entities.add(entity)
 
     def in_bounds(self, x: int, y: int, z: int) -> bool:
         """Return True if x and y are inside of the bounds of this map."""
@@ -43,6 +176,9 @@ class GameMap:
                 If it isn't, but it's in the "explored" array, then draw it with the "dark" colors.
                 Otherwise, the default is "SHROUD".
                 """
+        if self.see_through:
+            return self.render_see_through(console)
+
         console.rgb[0:self.width, 0:self.height] = np.select(
             condlist=[self.visible[self.view_depth], self.explored[self.view_depth]],
             choicelist=[self.tiles["light"][self.view_depth], self.tiles["dark"][self.view_depth]],
@@ -52,4 +188,39 @@ class GameMap:
         for entity in self.entities:
             # Only print entities that are in the FOV
             if self.visible[entity.z,entity.x, entity.y] and entity.z==self.view_depth:
-                console.print(x=entity.x, y=entity.y, string=entity.char, fg=entity.color)
\ No newline at end of file
+                console.print(x=entity.x, y=entity.y, string=entity.char, fg=entity.color)
+
+    def render_see_through(self, console: Console) -> None:
+        """
+        Renders the map, looking down through air into the levels below view_depth.
+
+        Each column is followed down from view_depth until it hits a grounded tile, or a tile the player
+        hasn't seen, in one vectorized pass over the volume. That tile is drawn like in render,
+        but darkened by how many levels below view_depth it is.
+        Visible entities between view_depth and that tile are drawn the same way, nearest on top.
+        """
+        view_depth = self.view_depth
+        seen = self.visible[view_depth:] | self.explored[view_depth:]
+        stops = self.tiles["grounded"][view_depth:] | ~seen
+        stops[-1] = True  # Nothing can be seen below the bottom of the map.
+        levels = stops.argmax(axis=0)  # The first stop along z, for every column at once.
+
+        z = view_depth + levels
+        x, y = np.indices((self.width, self.height))
+        tiles = self.tiles[z, x, y]
+        graphics = np.select(
+            condlist=[self.visible[z, x, y], self.explored[z, x, y]],
+            choicelist=[tiles["light"], tiles["dark"]],
+            default=tile_types.SHROUD
+        )
+        shade = np.maximum(1 - DEPTH_SHADE * levels, MIN_SHADE)[..., np.newaxis]
+        graphics["fg"] = graphics["fg"] * shade
+        graphics["bg"] = graphics["bg"] * shade
+        console.rgb[0:self.width, 0:self.height] = graphics
+
+        for entity in sorted(self.entities, key=lambda entity: entity.z, reverse=True):
+            # Only print entities that are in the FOV and not hidden under the tile drawn for their column.
+            if self.visible[entity.z, entity.x, entity.y] and view_depth <= entity.z <= z[entity.x, entity.y]:
+                entity_shade = max(1 - DEPTH_SHADE * (entity.z - view_depth), MIN_SHADE)
+                color = tuple(int(channel * entity_shade) for channel in entity.color)
+                console.print(x=entity.x, y=entity.y, string=entity.char, fg=color)
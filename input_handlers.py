@@ -24,6 +24,8 @@ class EventHandler(tcod.event.EventDispatch[Action]):
             self.engine.game_map.view_depth +=1
         if key == tcod.event.KeySym.COMMA:
             self.engine.game_map.view_depth -= 1
+        if key == tcod.event.KeySym.TAB:
+            self.engine.game_map.see_through = not self.engine.game_map.see_through
 
         if key == tcod.event.KeySym.UP:
             action = BumpAction(dx=0, dy=-1, dz=0)
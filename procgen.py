@@ -82,7 +82,7 @@ def tunnel_between(
 
 def join_rooms(dungeon: GameMap, room1: RectPrismRoom, room2: RectPrismRoom) -> None:
     for z, x, y in tunnel_between(room1.floor_center, room2.floor_center):
-        dungeon.tiles[z, x, y] = tile_types.floor
+        dungeon.set_tiles((z, x, y), tile_types.floor)
 
 
 def generate_dungeon(
@@ -161,8 +161,8 @@ def generate_dungeon(
             # If there are no intersections then the room is valid.
 
             # Dig out this rooms inner area.
-            dungeon.tiles[new_room.inner] = tile_types.floor
-            dungeon.tiles[new_room.air_inner] = tile_types.air
+            dungeon.set_tiles(new_room.inner, tile_types.floor)
+            dungeon.set_tiles(new_room.air_inner, tile_types.air)
 
             if len(rooms) == 0:
                 # The first room, where the player starts.
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import itertools
+from typing import Any, Dict, List, Set, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+# Tiles are copied on write in cubes of this many tiles per side.
+BLOCK_SIZE = 16
+
+
+class Snapshot:
+    """
+    The undo record for a single turn.
+
+    Rather than copying the whole world, a snapshot only holds what changed since the previous one:
+    the old contents of tile blocks that were written to, the tiles that became explored,
+    and the old fields of entities that were changed, along with the ones that were spawned.
+    Restoring it puts the map back the way it was when the previous snapshot was taken.
+    """
+
+    def __init__(self) -> None:
+        # Old contents of each tile block touched this turn, keyed by block coordinates (z, x, y).
+        self.tile_blocks: Dict[Tuple[int, int, int], np.ndarray] = {}
+        # Indices (z, x, y) of tiles that went from unexplored to explored this turn.
+        self.explored: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        # Fields each changed entity had before its first change this turn.
+        self.entity_fields: Dict[Entity, Dict[str, Any]] = {}
+        # Entities that were spawned this turn.
+        self.added: Set[Entity] = set()
+
+    def save_tile_blocks(self, tiles: np.ndarray, index: Any) -> None:
+        """Copy each block touched by `index` that hasn't already been saved this turn."""
+        for block in blocks_touched(index, tiles.shape):
+            if block not in self.tile_blocks:
+                self.tile_blocks[block] = tiles[block_index(*block)].copy()
+
+    def save_entity(self, entity: Entity) -> None:
+        """Copy an entity's fields, unless they were already saved or it was spawned this turn."""
+        if entity not in self.entity_fields and entity not in self.added:
+            self.entity_fields[entity] = vars(entity).copy()
+
+    def restore(self, tiles: np.ndarray, explored: np.ndarray) -> None:
+        """Put the tile and explored arrays back the way they were before this turn."""
+        for (bz, bx, by), block in self.tile_blocks.items():
+            tiles[block_index(bz, bx, by)] = block
+        for indices in self.explored:
+            explored[indices] = False
+
+
+def blocks_touched(index: Any, shape: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    """
+    Return the coordinates of every block that writing to the tiles at `index` touches.
+
+    Index arrays are expanded and broadcast together the way numpy does, so boolean masks select their
+    own positions and paired arrays such as (zs, xs, ys) only touch the blocks of the points they name.
+    Only the axes indexed with slices are combined with every block along the others.
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    axes: List[Any] = []
+    for axis_index in index:
+        if isinstance(axis_index, (slice, int, np.integer)):
+            axes.append(axis_index)
+            continue
+        positions = np.asarray(axis_index)
+        if positions.dtype == bool:
+            axes.extend(np.nonzero(positions))  # A mask over several axes stands for one array per axis.
+        elif np.issubdtype(positions.dtype, np.integer):
+            axes.append(positions)
+        else:
+            raise TypeError(f"Can't save tiles written with the index {axis_index!r}")
+    if len(axes) > len(shape):
+        raise TypeError(f"Too many indices for the tile array: {index!r}")
+    axes += [slice(None)] * (len(shape) - len(axes))
+
+    sliced = [axis for axis, axis_index in enumerate(axes) if isinstance(axis_index, slice)]
+    advanced = [axis for axis, axis_index in enumerate(axes) if not isinstance(axis_index, slice)]
+
+    # The distinct combinations of blocks that the points named by the index arrays fall in.
+    if advanced:
+        arrays = np.broadcast_arrays(*(np.asarray(axes[axis]) for axis in advanced))
+        points = np.stack([array.ravel() % shape[axis] // BLOCK_SIZE for array, axis in zip(arrays, advanced)])
+        if points.shape[1] == 0:
+            return []  # Nothing is written.
+        combinations = np.unique(points, axis=1).T.tolist()
+    else:
+        combinations = [[]]
+    # Every block along each axis indexed with a slice.
+    sliced_blocks = [np.unique(np.arange(shape[axis])[axes[axis]] // BLOCK_SIZE).tolist() for axis in sliced]
+
+    blocks = []
+    for combination in combinations:
+        for sliced_combination in itertools.product(*sliced_blocks):
+            block = [0] * len(shape)
+            for axis, number in zip(advanced, combination):
+                block[axis] = number
+            for axis, number in zip(sliced, sliced_combination):
+                block[axis] = number
+            blocks.append(tuple(block))
+    return blocks
+
+
+def block_index(bz: int, bx: int, by: int) -> Tuple[slice, slice, slice]:
+    """Return the array index of the tile block at the given block coordinates."""
+    return (
+        slice(bz * BLOCK_SIZE, (bz + 1) * BLOCK_SIZE),
+        slice(bx * BLOCK_SIZE, (bx + 1) * BLOCK_SIZE),
+        slice(by * BLOCK_SIZE, (by + 1) * BLOCK_SIZE),
+    )